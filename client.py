@@ -0,0 +1,8 @@
+import httpx
+
+# One keep-alive client for the whole process, shared by the Ollama and Google CSE requests
+http_client = httpx.Client(
+    http2=True,
+    limits=httpx.Limits(max_keepalive_connections=40, max_connections=100, keepalive_expiry=30.0),
+    timeout=httpx.Timeout(300.0, connect=10.0),
+)
@@ -0,0 +1,123 @@
+import hashlib
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+from functools import lru_cache
+import numpy as np
+import simsimd
+from client import http_client
+
+OLLAMA_URL = "http://localhost:11434"
+EMBEDDING_MODEL = "snowflake-arctic-embed:latest"
+CACHE_PATH = ".embeddings.sqlite"
+MAX_WORKERS = 8
+
+# Open the on-disk embedding cache, vectors are stored as int8 bytes keyed by (model, sha256(text))
+def _connect():
+    conn = sqlite3.connect(CACHE_PATH)
+    conn.execute("CREATE TABLE IF NOT EXISTS emb_i8(model TEXT, hash BLOB, vec BLOB, PRIMARY KEY(model, hash))")
+    return conn
+
+def _hash(text):
+    return hashlib.sha256(text.encode()).digest()
+
+def _cache_get(hashes):
+    if not hashes:
+        return {}
+    placeholders = ",".join("?" * len(hashes))
+    with closing(_connect()) as conn:
+        rows = conn.execute(
+            f"SELECT hash, vec FROM emb_i8 WHERE model=? AND hash IN ({placeholders})",
+            (EMBEDDING_MODEL, *hashes),
+        ).fetchall()
+    # Rows are written unit length, rescaling each by its own norm undoes the int8 rounding drift
+    return {h: _normalize(np.frombuffer(vec, dtype=np.int8)) for h, vec in rows}
+
+def _cache_put(items):
+    with closing(_connect()) as conn, conn:
+        conn.executemany(
+            "INSERT OR REPLACE INTO emb_i8(model, hash, vec) VALUES (?, ?, ?)",
+            [(EMBEDDING_MODEL, h, quantize(vec)[0].tobytes()) for h, vec in items],
+        )
+
+# Symmetric int8 quantization with one scale per vector (per row for matrices), a quarter of the float32 size
+def quantize(embeddings):
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    peak = np.abs(embeddings).max(axis=-1, keepdims=True)
+    scale = 127.0 / np.maximum(peak, 1e-12)
+    return np.round(embeddings * scale).astype(np.int8), scale[..., 0]
+
+# Every embedding handed out by this module is L2-normalized once, before it is cached, so relatedness
+# is a bare dot product everywhere downstream and callers must not normalize again
+def _normalize(vec):
+    vec = np.asarray(vec, dtype=np.float32)
+    return vec / (np.linalg.norm(vec) + 1e-12)
+
+# Function to calculate relatedness between two unit length vectors with the SIMD dot kernel
+def relatedness_function(a, b):
+    return float(simsimd.dot(np.asarray(a, dtype=np.float32), np.asarray(b, dtype=np.float32)))
+
+# Function to score one query against every row of an embedding matrix in one call
+# int8 matrices are scored as is, cosine ignores the per-row scale so no dequantization is needed
+def relatedness_scores(query_embedding, embeddings):
+    if embeddings.dtype == np.int8:
+        query = quantize(query_embedding)[0][None, :]
+        matrix = np.ascontiguousarray(embeddings)
+        return 1.0 - np.asarray(simsimd.cdist(query, matrix, metric="cosine"))[0]
+    # float rows are unit length, so scores are a single matrix-vector product
+    return np.asarray(embeddings, dtype=np.float32) @ np.asarray(query_embedding, dtype=np.float32)
+
+# Function to order rows by relatedness, highest first
+def rank_by_relatedness(query_embedding, embeddings):
+    scores = relatedness_scores(query_embedding, embeddings)
+    order = np.argsort(-scores, kind='stable')
+    return order, scores[order]
+
+# In-memory layer on top of the SQLite cache for hot hits within the same process
+@lru_cache(maxsize=512)
+def _embedding(text):
+    h = _hash(text)
+    cached = _cache_get([h])
+    if h in cached:
+        return cached[h]
+    response = http_client.post(f"{OLLAMA_URL}/api/embeddings", json={"model": EMBEDDING_MODEL, "prompt": text})
+    vec = _normalize(response.json()["embedding"])
+    _cache_put([(h, vec)])
+    return vec
+
+# Function for making an embedding request with error handling
+def get_embedding(text):
+    print(f"Requesting embedding for: {text}")
+    try:
+        return _embedding(text)
+    except Exception as e:
+        print(f"Error requesting embedding: {e}")
+        return None
+
+# Function for embedding several texts, cache misses are sent in a single /api/embed roundtrip
+def get_embeddings(texts):
+    print(f"Requesting embeddings for {len(texts)} texts")
+    hashes = [_hash(text) for text in texts]
+    try:
+        cached = _cache_get(hashes)
+    except sqlite3.Error as e:
+        print(f"Error reading embedding cache: {e}")
+        cached = {}
+    missing = [text for text, h in zip(texts, hashes) if h not in cached]
+    if missing:
+        try:
+            response = http_client.post(f"{OLLAMA_URL}/api/embed", json={"model": EMBEDDING_MODEL, "input": missing})
+            data = response.json()
+            if "embeddings" in data:
+                fetched = [(_hash(text), _normalize(vec)) for text, vec in zip(missing, data["embeddings"])]
+                cached.update(fetched)
+                _cache_put(fetched)
+            else:
+                print(f"No 'embeddings' found in Ollama response, falling back to per-text requests: {data}")
+        except Exception as e:
+            print(f"Error requesting embeddings: {e}")
+    # Anything the batch request did not return is embedded one text at a time, overlapping the requests
+    remaining = [text for text, h in zip(texts, hashes) if h not in cached]
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        fallback = dict(zip(remaining, executor.map(get_embedding, remaining)))
+    return [cached[h] if h in cached else fallback[text] for text, h in zip(texts, hashes)]
@@ -1,13 +1,11 @@
 import os
+import numpy as np
 import pandas as pd
-import json
 import streamlit as st
-from scipy import spatial
-from glob import glob
 from langchain_core.prompts import PromptTemplate
 from langchain_core.pydantic_v1 import BaseModel, Field
 from langchain_experimental.llms.ollama_functions import OllamaFunctions
-from langchain_community.embeddings import OllamaEmbeddings
+from embeddings import get_embedding, get_embeddings, rank_by_relatedness
 from search import arxiv_search
 from search import google_custom_search
 
@@ -20,45 +18,85 @@ st.title("PrivyLens - Similarity Search 🔍")
 
 search_engine = st.selectbox("Select Search Engine:", ["arXiv", "CSE"])
 
-# Function to calculate relatedness between two vectors
-def relatedness_function(a, b):
-    return 1 - spatial.distance.cosine(a, b)
-
-# Function for making an embedding request with error handling
-def get_embedding(text):
-    print(f"Requesting embedding for: {text}")
-    try:
-        embeddings = OllamaEmbeddings(model="snowflake-arctic-embed:latest")
-        return embeddings.embed_query(text)
-    except Exception as e:
-        print(f"Error requesting embedding: {e}")
-        return None
-
-# Function to rank titles based on relatedness
-def titles_ranked_by_relatedness(query, source):
-    query_embedding = get_embedding(query)
-
+# Reuse the query embedding across reruns and search engines within a session
+def get_query_embedding(query):
+    key = f"qemb:{query}"
+    if key not in st.session_state:
+        embedding = get_embedding(query)
+        if embedding is None:
+            return None
+        st.session_state[key] = embedding
+    return st.session_state[key]
+
+def _rank_titles(query, source, query_embedding):
     if source == "arXiv":
-        df = pd.read_csv(f'.arxiv/{query}.csv', header=None)  
-        strings_and_relatedness = [
-            (row[0], row[1], row[2], row[3], relatedness_function(query_embedding, json.loads(row[4]))) 
-            for i, row in df.iterrows()
-        ]
-        strings_and_relatedness.sort(key=lambda x: x[4], reverse=True)
+        folder, columns = '.arxiv', [0, 1, 2, 3]
     elif source == "CSE":
-        df = pd.read_csv(f'.cse/{query}.csv', header=None)  
-        strings_and_relatedness = [ 
-            (row[0], row[1], row[2], relatedness_function(query_embedding, json.loads(row[3]))) 
-            for i, row in df.iterrows()
-        ]
-        strings_and_relatedness.sort(key=lambda x: x[3], reverse=True)
+        folder, columns = '.cse', [0, 1, 2]
     else:
         raise ValueError(f"Invalid source: {source}")  # Handle unknown sources
 
-    return strings_and_relatedness
+    sidecar_path = f'{folder}/{query}.npy'
+    embeddings = None
+    if query_embedding is not None and os.path.exists(sidecar_path):
+        try:
+            embeddings = np.load(sidecar_path, mmap_mode='r')
+        except (ValueError, EOFError, OSError) as e:
+            print(f"Error loading {sidecar_path}: {e}")
+
+    df = pd.read_csv(f'{folder}/{query}.csv', header=None)
+    if embeddings is None or embeddings.shape != (len(df), len(query_embedding)):
+        # Searches saved before the sidecar existed, or whose sidecar no longer lines up with the CSV
+        # or the current embedding model, are ordered by the score stored in the CSV
+        df = df.sort_values(by=len(columns), ascending=False)
+        return list(df.itertuples(index=False, name=None))
+
+    # Rank the rows against the sidecar matrix in one call instead of row by row
+    order, scores = rank_by_relatedness(query_embedding, embeddings)
+    return list(df[columns].iloc[order].assign(score=scores).itertuples(index=False, name=None))
+
+# Cached on the CSV's mtime so reruns skip the work and a rewritten search invalidates it
+@st.cache_data(show_spinner=False, max_entries=64)
+def _cached_rank_titles(query, source, mtime, query_embedding):
+    return _rank_titles(query, source, query_embedding)
+
+# Function to rank titles based on relatedness
+def titles_ranked_by_relatedness(query, source, mtime):
+    query_embedding = get_query_embedding(query)
+    if query_embedding is None:
+        # Ollama is unreachable, the stored-score order is not cached so a later rerun re-ranks
+        return _rank_titles(query, source, None)
+    return _cached_rank_titles(query, source, mtime, query_embedding)
+
+# List past searches once per folder with a single listdir, cleared whenever a search is saved or deleted
+@st.cache_data(ttl=5, show_spinner=False)
+def list_past_searches():
+    searches_by_source = {}
+    for folder in ('.arxiv', '.cse'):
+        if os.path.isdir(folder):
+            files = sorted(name for name in os.listdir(folder) if name.endswith('.csv'))
+            if files:
+                searches_by_source[folder] = [(folder, file_name) for file_name in files]
+    return searches_by_source
+
+# Render a single search result
+def show_result(i, result, search_engine):
+    if search_engine == "arXiv":
+        title, summary, published, url, score = result['title'], result['summary'], result['published'], result['pdf_url'], result['relatedness_score']
+        st.subheader(f"Result {i}: {title}")
+        st.write(f"Summary: {summary}")
+        st.write(f"Published: {published}")
+        st.write(f"URL: {url}")
+    elif search_engine == "CSE":  
+        title, snippet, url, score = result['title'], result['snippet'], result['link'], result['relatedness_score']
+        st.subheader(f"Result {i}: {title}")
+        st.write(f"Snippet: {snippet}")
+        st.write(f"URL: {url}")
+    st.write(f"Relatedness Score: {score:.2f}")
+    st.write("---")
 
 # Prompt template for keyword generation
-prompt = PromptTemplate.from_template(
+keyword_prompt = (
     """<|begin_of_text|><|start_header_id|>system<|end_header_id|>
     You are a research assistant specializing in generating precise and effective search queries for scientific databases like PubMed, CINAHL, or Web of Science. 
 
@@ -86,63 +124,52 @@ prompt = PromptTemplate.from_template(
     <|eot_id|><|start_header_id|>assistant<|end_header_id|>"""
 )
 
-# Chain
-llm = OllamaFunctions(model="llama3", 
-                      format="json", 
-                      temperature=0.6)
-
-structured_llm = llm.with_structured_output(Keywords)
-chain = prompt | structured_llm
+# Chain, built once per process instead of on every rerun
+@st.cache_resource
+def get_chain():
+    prompt = PromptTemplate.from_template(keyword_prompt)
+    llm = OllamaFunctions(model="llama3", 
+                          format="json", 
+                          temperature=0.6)
+    structured_llm = llm.with_structured_output(Keywords)
+    return prompt | structured_llm
 
 with st.form('search_form'):
     query = st.text_area('Enter text:', max_chars=500)
     if st.form_submit_button('Search'):
+        chain = get_chain()
         response = chain.invoke({"query": query})
         keywords = response.keywords
         print(f"Generated Keywords: {keywords}")
         st.header(f"📚 Search Results: {keywords}")
         with st.spinner(f"Searching {search_engine}..."):
             if search_engine == "arXiv":
-                results = arxiv_search(keywords, get_embedding)
+                # Streams results as their embeddings arrive
+                search_results = arxiv_search(keywords, get_embeddings, get_query_embedding(keywords))
             elif search_engine == "CSE":
-                results = google_custom_search(keywords, get_embedding)
+                search_results = google_custom_search(keywords, get_embeddings, get_query_embedding(keywords))
             else:
                 st.error(f"Unknown search engine: {search_engine}")
-                results = []
-        
+                search_results = []
+
+            # Re-render the placeholders in score order each time a result arrives
+            placeholders = [st.empty() for _ in range(10)]
+            results = []
+            for result in search_results:
+                results.append(result)
+                results.sort(key=lambda r: r['relatedness_score'], reverse=True)
+                for i, (placeholder, ranked) in enumerate(zip(placeholders, results), start=1):
+                    with placeholder.container():
+                        show_result(i, ranked, search_engine)
+
         if not results:
             st.warning(f"No search results found on {search_engine}.")
         else:
-            for i, result in enumerate(results, start=1):
-                if search_engine == "arXiv":
-                    title, summary, published, url, score = result['title'], result['summary'], result['published'], result['pdf_url'], result['relatedness_score']
-                    st.subheader(f"Result {i}: {title}")
-                    st.write(f"Summary: {summary}")
-                    st.write(f"Published: {published}")
-                    st.write(f"URL: {url}")
-                elif search_engine == "CSE":  
-                    title, snippet, url, score = result['title'], result['snippet'], result['link'], result['relatedness_score']
-                    st.subheader(f"Result {i}: {title}")
-                    st.write(f"Snippet: {snippet}")
-                    st.write(f"URL: {url}")
-                st.write(f"Relatedness Score: {score:.2f}")
-                st.write("---")
+            list_past_searches.clear()
 
 # Sidebar sections
 st.sidebar.header("Past Searches 📚")
-past_searches = glob('.arxiv/*.csv') + glob('.cse/*.csv')
-past_searches_with_folder = [(os.path.dirname(file), os.path.basename(file)) for file in past_searches]
-past_search_options = [(folder, file) for folder, file in past_searches_with_folder]
-
-# Group searches by source
-searches_by_source = {}
-for file_path in past_searches:
-    folder = os.path.dirname(file_path)
-    file_name = os.path.basename(file_path)
-    source = folder.split('/')[-1]  # Extract source from folder name
-    if source not in searches_by_source:
-        searches_by_source[source] = []
-    searches_by_source[source].append((folder, file_name))
+searches_by_source = list_past_searches()
 
 for source, searches in searches_by_source.items():
     with st.sidebar.expander(source):
@@ -166,6 +193,10 @@ for source, searches in searches_by_source.items():
                     file_path = os.path.join(folder, file_name)
                     try:
                         os.remove(file_path)
+                        sidecar_path = os.path.splitext(file_path)[0] + '.npy'
+                        if os.path.exists(sidecar_path):
+                            os.remove(sidecar_path)
+                        list_past_searches.clear()
                         st.success(f"Deleted: {search_label}")
                         st.rerun()  # Rerun the app to update the sidebar
                     except FileNotFoundError:
@@ -176,12 +207,10 @@ if 'load_arxiv_results' in st.session_state:
     query = st.session_state['load_arxiv_results']
     file_path = os.path.join('.arxiv', query + '.csv') 
     try:
-        df = pd.read_csv(file_path, header=None)
-        df = df.sort_values(by=4, ascending=False)  
+        ranked = titles_ranked_by_relatedness(query, "arXiv", os.path.getmtime(file_path))
         st.header(f"📚 ArXiv Results: {query}")
-        for i, row in df.iterrows():
-            title, summary, published, url, score = row[0], row[1], row[2], row[3], row[4]
-            st.subheader(f"Result {i + 1}: {title}")
+        for i, (title, summary, published, url, score) in enumerate(ranked, start=1):
+            st.subheader(f"Result {i}: {title}")
             st.write(f"Summary: {summary}")
             st.write(f"Published: {published}")
             st.write(f"URL: {url}")
@@ -196,12 +225,10 @@ if 'load_cse_results' in st.session_state:
     query = st.session_state['load_cse_results']
     file_path = os.path.join('.cse', query + '.csv') 
     try:
-        df = pd.read_csv(file_path, header=None)
-        df = df.sort_values(by=3, ascending=False) 
+        ranked = titles_ranked_by_relatedness(query, "CSE", os.path.getmtime(file_path))
         st.header(f"📚 CSE Results: {query}")
-        for i, row in df.iterrows():
-            title, snippet, link, score = row[0], row[1], row[2], row[3]
-            st.subheader(f"Result {i + 1}: {title}")
+        for i, (title, snippet, link, score) in enumerate(ranked, start=1):
+            st.subheader(f"Result {i}: {title}")
             st.write(f"Snippet: {snippet}")
             st.write(f"URL: {link}")
             st.write(f"Relatedness Score: {score:.2f}") 
@@ -10,8 +10,17 @@ from langchain.schema import Document
 from langgraph.graph import END, StateGraph
 from chains import answer_grader, hallucination_grader, question_router, generation_chain, retrieval_grader, question_rewriter, summary_chain
 
-embedding = OllamaEmbeddings(model="snowflake-arctic-embed:latest")
-web_search_tool = TavilySearchResults(k=3)
+# Clients are built once per process instead of on every rerun
+@st.cache_resource
+def get_embedding_model():
+    return OllamaEmbeddings(model="snowflake-arctic-embed:latest")
+
+@st.cache_resource
+def get_web_search_tool():
+    return TavilySearchResults(k=3)
+
+embedding = get_embedding_model()
+web_search_tool = get_web_search_tool()
 
 class GraphState(TypedDict):
     question : str
@@ -1,76 +1,177 @@
 import os
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import arxiv
-import requests
+import numpy as np
 import pandas as pd
-from scipy import spatial
+import streamlit as st
+from client import http_client
+from embeddings import quantize, relatedness_function, relatedness_scores
 
-def arxiv_search(query, embedding_request):
+SIMILAR_QUERY_THRESHOLD = 0.95
+PAST_QUERY_TTL = 7 * 24 * 3600
+ARXIV_COLUMNS = ['title', 'summary', 'published', 'pdf_url', 'relatedness_score']
+CSE_COLUMNS = ['title', 'snippet', 'link', 'relatedness_score']
+STREAM_CHUNK_SIZE = 2
+
+# Past queries per source, row i of past_queries.npy is the embedding of line i of past_queries.txt
+# An index that is unreadable, misaligned or embedded at another dimension (a different model) is treated
+# as empty, so it is never scored and the next save replaces it
+def _load_past_queries(folder, dim):
+    try:
+        with open(f'{folder}/past_queries.txt') as f:
+            entries = [json.loads(line) for line in f]
+        embeddings = np.load(f'{folder}/past_queries.npy')
+    except (ValueError, EOFError, OSError):
+        return [], np.empty((0, dim), dtype=np.float32)
+    if embeddings.ndim != 2 or embeddings.shape != (len(entries), dim):
+        return [], np.empty((0, dim), dtype=np.float32)
+    # Drop stale entries and searches whose CSV has since been deleted
+    keep = [
+        i for i, (timestamp, past_query) in enumerate(entries)
+        if time.time() - timestamp < PAST_QUERY_TTL and os.path.exists(f'{folder}/{past_query}.csv')
+    ]
+    return [entries[i] for i in keep], embeddings[keep]
+
+def _save_past_queries(folder, entries, embeddings):
+    with open(f'{folder}/past_queries.txt', 'w') as f:
+        f.writelines(json.dumps(entry) + '\n' for entry in entries)
+    np.save(f'{folder}/past_queries.npy', embeddings)
+
+def _remember_query(folder, query, query_embedding):
+    entries, embeddings = _load_past_queries(folder, len(query_embedding))
+    keep = [i for i, (timestamp, past_query) in enumerate(entries) if past_query != query]
+    entries = [entries[i] for i in keep] + [[time.time(), query]]
+    vector = np.asarray(query_embedding, dtype=np.float32)[None, :]
+    embeddings = np.concatenate([embeddings[keep].astype(np.float32), vector]) if keep else vector
+    _save_past_queries(folder, entries, quantize(embeddings)[0])
+
+# Serve a near-duplicate of an earlier query straight from its saved CSV
+def _load_similar_search(folder, query_embedding, columns):
+    entries, embeddings = _load_past_queries(folder, len(query_embedding))
+    if not entries:
+        return None
+    scores = relatedness_scores(query_embedding, embeddings)
+    best = int(np.argmax(scores))
+    if scores[best] <= SIMILAR_QUERY_THRESHOLD:
+        return None
+    past_query = entries[best][1]
+    print(f"Reusing past search '{past_query}' (similarity {scores[best]:.3f})")
+    df = pd.read_csv(f'{folder}/{past_query}.csv', header=None, names=columns)
+    return df.to_dict('records')
+
+# Score, sort and persist embedded results, shared by every search engine
+def _save_search(folder, columns, query, query_embedding, kept):
+    if not kept:
+        return []
+    # Size the matrix from the embeddings themselves so a model change can never break the save
+    matrix = np.empty((len(kept), len(kept[0][1])), dtype=np.float32)
+    for row, (result, embedding) in zip(matrix, kept):
+        row[:] = embedding
+    df = pd.DataFrame([result for result, embedding in kept])
+    df['relatedness_score'] = relatedness_scores(query_embedding, matrix)
+    order = np.argsort(-df['relatedness_score'].to_numpy(), kind='stable')
+    df, matrix = df.iloc[order], matrix[order]
+    os.makedirs(folder, exist_ok=True)
+    df[columns].to_csv(f'{folder}/{query}.csv', index=False, header=False)
+    # Embeddings go to an int8 binary sidecar aligned row-wise with the CSV
+    np.save(f'{folder}/{query}.npy', quantize(matrix)[0])
+    _remember_query(folder, query, query_embedding)
+    return df.to_dict('records')
+
+def _rank_and_save(folder, columns, query, query_embedding, results, texts, embeddings_request):
+    # Embed all result texts in one request
+    embeddings = embeddings_request(texts)
+    # Results whose embedding request failed are dropped rather than scored
+    kept = [(result, embedding) for result, embedding in zip(results, embeddings) if embedding is not None]
+    return _save_search(folder, columns, query, query_embedding, kept)
+
+# Embed results in small concurrent batches and yield each one scored as soon as its batch returns,
+# the search is persisted once every batch is in
+def _stream_and_save(folder, columns, query, query_embedding, results, texts, embeddings_request):
+    chunks = [range(i, min(i + STREAM_CHUNK_SIZE, len(texts))) for i in range(0, len(texts), STREAM_CHUNK_SIZE)]
+    kept = []
+    with ThreadPoolExecutor(max_workers=max(len(chunks), 1)) as executor:
+        futures = {executor.submit(embeddings_request, [texts[i] for i in chunk]): chunk for chunk in chunks}
+        for future in as_completed(futures):
+            for i, embedding in zip(futures[future], future.result()):
+                # Results whose embedding request failed are dropped rather than scored
+                if embedding is None:
+                    continue
+                kept.append((results[i], embedding))
+                yield dict(results[i], relatedness_score=relatedness_function(query_embedding, embedding))
+    _save_search(folder, columns, query, query_embedding, kept)
+
+# arXiv lookups are memoized for an hour, results are plain dicts so Streamlit can pickle them
+@st.cache_data(ttl=3600, show_spinner=False)
+def _fetch_arxiv(query):
+    search = arxiv.Search(
+        query=query,
+        max_results=10,
+        sort_by=arxiv.SortCriterion.Relevance
+    )
+    results = []
+    for result in arxiv.Client().results(search):
+        results.append({
+            "title": result.title,
+            "summary": result.summary,
+            "published": result.published.strftime("%Y-%m-%d"),
+            "pdf_url": result.pdf_url
+        })
+    return results
+
+def arxiv_search(query, embeddings_request, query_embedding=None):
     print(f"Searching arXiv for: {query}")
     try:
-        search = arxiv.Search(
-            query=query,
-            max_results=10,
-            sort_by=arxiv.SortCriterion.Relevance
-        )
-        results = []
-        for result in search.results():
-            title = result.title
-            summary = result.summary
-            published = result.published.strftime("%Y-%m-%d")
-            url = result.pdf_url
-            embedding = embedding_request(summary)
-            results.append({
-                "title": title,
-                "summary": summary,
-                "published": published,
-                "pdf_url": url,
-                "embedding": embedding
-            })
-        df = pd.DataFrame(results)
-        df['relatedness_score'] = df['embedding'].apply(lambda x: 1 - spatial.distance.cosine(embedding_request(query), x))
-        df = df.sort_values('relatedness_score', ascending=False)
-        os.makedirs('.arxiv', exist_ok=True)
-        os.makedirs('.arxiv', exist_ok=True)
-        df[['title', 'summary', 'published', 'pdf_url', 'relatedness_score']].to_csv(f'.arxiv/{query}.csv', index=False, header=False)
-        return df.to_dict('records')
+        if query_embedding is None:
+            query_embedding = embeddings_request([query])[0]
+        similar = _load_similar_search('.arxiv', query_embedding, ARXIV_COLUMNS)
+        if similar is not None:
+            yield from similar
+            return
+        results = _fetch_arxiv(query)
+        texts = [result["summary"] for result in results]
+        yield from _stream_and_save('.arxiv', ARXIV_COLUMNS, query, query_embedding, results, texts, embeddings_request)
     except Exception as e:
         print(f"Error searching arXiv: {e}")
-        return []
 
-def google_custom_search(query, embedding_request):
+# CSE lookups are memoized for ten minutes, error responses raise so they are never cached
+@st.cache_data(ttl=600, show_spinner=False)
+def _fetch_cse(query):
+    url = "https://www.googleapis.com/customsearch/v1"
+    params = {
+        "key": os.getenv('GOOGLE_CSE_KEY'),
+        "cx": os.getenv('GOOGLE_CSE_ID'),
+        "q": query
+    }
+    response = http_client.get(url, params=params)
+    data = response.json()
+    if 'error' in data:
+        raise ValueError(f"CSE request failed: {data['error']}")
+    results = []
+    if 'items' in data:
+        for item in data['items']:
+            results.append({
+                "title": item['title'],
+                "snippet": item['snippet'],
+                "link": item['link']
+            })
+    else:
+        print(f"No 'items' found in CSE response. Full response: {data}")
+    return results
+
+def google_custom_search(query, embeddings_request, query_embedding=None):
     print(f"Searching CSE for: {query}")
     try:
-        url = "https://www.googleapis.com/customsearch/v1"
-        params = {
-            "key": os.getenv('GOOGLE_CSE_KEY'),
-            "cx": os.getenv('GOOGLE_CSE_ID'),
-            "q": query
-        }
-        response = requests.get(url, params=params)
-        data = response.json()
-        results = []
-        if 'items' in data:
-            for item in data['items']:
-                title = item['title']
-                snippet = item['snippet']
-                link = item['link']
-                embedding = embedding_request(snippet)
-                results.append({
-                    "title": title,
-                    "snippet": snippet,
-                    "link": link,
-                    "embedding": embedding
-                })
-        else:
-            print(f"No 'items' found in CSE response. Full response: {data}")
-        
-        df = pd.DataFrame(results)  
-        df['relatedness_score'] = df['embedding'].apply(lambda x: 1 - spatial.distance.cosine(embedding_request(query), x))
-        df = df.sort_values('relatedness_score', ascending=False)
-        os.makedirs('.cse', exist_ok=True)
-        os.makedirs('.cse', exist_ok=True)
-        df[['title', 'snippet', 'link', 'relatedness_score']].to_csv(f'.cse/{query}.csv', index=False, header=False)
-        return df.to_dict('records')
+        if query_embedding is None:
+            query_embedding = embeddings_request([query])[0]
+        similar = _load_similar_search('.cse', query_embedding, CSE_COLUMNS)
+        if similar is not None:
+            return similar
+        results = _fetch_cse(query)
+        texts = [f"{result['title']} {result['snippet']}" for result in results]
+        return _rank_and_save('.cse', CSE_COLUMNS, query, query_embedding, results, texts, embeddings_request)
     except Exception as e:
         print(f"Error searching CSE: {e}") 
         return []